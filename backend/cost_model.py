@@ -0,0 +1,314 @@
+import os
+import re
+import json
+import subprocess
+import threading
+from collections import deque
+from pathlib import Path
+
+# Handle both package and direct run imports
+try:
+    from .ffmpeg_utils import FFPROBE_EXE
+    from .rendering import build_filter_complex
+except ImportError:
+    from ffmpeg_utils import FFPROBE_EXE
+    from rendering import build_filter_complex
+
+# Fallback source properties when ffprobe can't read the file
+# (duration matches the default used by get_video_duration)
+DEFAULT_PROPERTIES = {"duration": 10.0, "width": 1280, "height": 720, "fps": 30.0}
+
+# Seconds of libx264 ultrafast re-encode per megapixel of output frame
+BASE_COST_PER_MPIX_FRAME = 0.004
+
+# Extra per-frame work each filter adds, as a fraction of the base re-encode
+FILTER_COSTS = {
+    "drawtext": 0.15,
+    "overlay": 0.35,
+    "scale": 0.2,
+    "format": 0.1,
+    "setpts": 0.02,
+}
+
+# Seconds per source second when there are no overlays and we stream copy
+COPY_COST_PER_SECOND = 0.01
+
+# Completed jobs kept per kind for fitting the coefficients
+FIT_WINDOW = 50
+
+# Ridge strength pulling each fitted multiplier back to 1 (the static costs
+# above), roughly "this many jobs' worth" of prior evidence
+FIT_PRIOR_WEIGHT = 0.5
+
+# Fitted multipliers are clamped so a few odd jobs can't zero out or blow up a cost
+MULTIPLIER_RANGE = (0.05, 20.0)
+
+# Matches the filter name after the input labels, e.g. "[v1][2:v]overlay="
+FILTER_NAME_RE = re.compile(r"^(?:\[[^\]]*\])+(\w+)=")
+
+
+def probe_video(video_path):
+    """
+    Get duration, resolution and fps of the main video stream using ffprobe.
+    Width and height are as displayed: ffmpeg auto-rotates, so a portrait
+    phone video coded 1920x1080 with a 90 degree rotation reports 1080x1920.
+    Missing values fall back to DEFAULT_PROPERTIES.
+    """
+    props = dict(DEFAULT_PROPERTIES)
+    try:
+        cmd = [
+            str(FFPROBE_EXE),
+            "-v", "error",
+            "-select_streams", "v:0",
+            "-show_streams", "-show_format",
+            "-of", "json",
+            str(video_path)
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            return props
+
+        info = json.loads(result.stdout or "{}")
+        duration = info.get("format", {}).get("duration")
+        if duration:
+            props["duration"] = float(duration)
+
+        streams = info.get("streams") or [{}]
+        stream = streams[0]
+        if stream.get("width") and stream.get("height"):
+            props["width"] = int(stream["width"])
+            props["height"] = int(stream["height"])
+
+            # Rotation is display matrix side data (newer ffmpeg) or a
+            # "rotate" tag (older); 90/270 swaps the displayed dimensions
+            rotation = stream.get("tags", {}).get("rotate", 0)
+            for side_data in stream.get("side_data_list", []):
+                if "rotation" in side_data:
+                    rotation = side_data["rotation"]
+            if int(float(rotation)) % 180 != 0:
+                props["width"], props["height"] = props["height"], props["width"]
+
+        # r_frame_rate is a fraction like "30000/1001"
+        rate = stream.get("r_frame_rate", "")
+        if "/" in rate:
+            num, den = rate.split("/")
+            if float(den) > 0 and float(num) > 0:
+                props["fps"] = float(num) / float(den)
+    except Exception as e:
+        print(f"Error probing video: {e}")
+    return props
+
+
+def overlay_mix(inputs, overlays):
+    """
+    Count the filters build_filter_complex produces for these overlays.
+    Overlays whose asset can't be resolved are dropped there, so they
+    don't count here either.
+    Returns a dict of filter name -> count.
+    """
+    filter_str, _ = build_filter_complex(inputs, overlays)
+    mix = {name: 0 for name in FILTER_COSTS}
+    if not filter_str:
+        return mix
+
+    for chain in filter_str.split(";"):
+        match = FILTER_NAME_RE.match(chain)
+        if match and match.group(1) in mix:
+            mix[match.group(1)] += 1
+    return mix
+
+
+def solve_linear(a, b):
+    """Solve a @ x = b for a small square system (Gaussian elimination)."""
+    n = len(b)
+    m = [list(row) + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+        if abs(m[col][col]) < 1e-12:
+            raise ValueError("Singular system")
+        for r in range(col + 1, n):
+            f = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= f * m[col][c]
+    x = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+class RenderCostModel:
+    """
+    Predicts render time in seconds from source properties and overlay mix.
+
+    The prediction is a sum of components: the base re-encode plus one term
+    per filter type (or a single stream copy term). Each component has a
+    multiplier on its static cost above, fitted by ridge least squares over
+    the last FIT_WINDOW completed jobs of that kind, so e.g. overlays can
+    turn out relatively more expensive than plain encoding on this machine.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.multipliers = {
+            "encode": {name: 1.0 for name in ["base"] + list(FILTER_COSTS)},
+            "copy": {"copy": 1.0},
+        }
+        self.history = {"encode": deque(maxlen=FIT_WINDOW), "copy": deque(maxlen=FIT_WINDOW)}
+        self.samples = {"encode": 0, "copy": 0}
+        self.history_path = None
+
+    def raw_cost(self, props, mix):
+        """
+        Uncalibrated cost split into components.
+        Returns (kind, {component: seconds}).
+        """
+        duration = props["duration"]
+        if not any(mix.values()):
+            # render_video stream copies when there is no filter
+            return "copy", {"copy": duration * COPY_COST_PER_SECOND}
+
+        frames = duration * props["fps"]
+        mpix = props["width"] * props["height"] / 1e6
+        base = frames * mpix * BASE_COST_PER_MPIX_FRAME
+        components = {"base": base}
+        for name, count in mix.items():
+            components[name] = base * FILTER_COSTS[name] * count
+        return "encode", components
+
+    def estimate(self, props, mix):
+        """
+        Fitted estimate for a render.
+        Returns a dict that can be passed back to record() once the job is done.
+        """
+        kind, components = self.raw_cost(props, mix)
+        with self._lock:
+            multipliers = dict(self.multipliers[kind])
+            samples = self.samples[kind]
+        estimated = sum(seconds * multipliers[name] for name, seconds in components.items())
+        return {
+            "kind": kind,
+            "components": components,
+            "raw_seconds": sum(components.values()),
+            "estimated_seconds": round(estimated, 2),
+            "calibration_samples": samples,
+            "source": dict(props),
+            "overlay_mix": dict(mix),
+        }
+
+    def record(self, estimate, actual_seconds):
+        """Add the measured time of a completed render and refit its kind."""
+        components = estimate.get("components", {})
+        raw = sum(components.values())
+        if raw <= 0 or actual_seconds <= 0:
+            return
+
+        kind = estimate["kind"]
+        with self._lock:
+            self.samples[kind] += 1
+            self.history[kind].append((components, actual_seconds))
+            self._fit(kind)
+            fitted = sum(seconds * self.multipliers[kind][name] for name, seconds in components.items())
+            self._save()
+        print(f"Cost model ({kind}): actual {actual_seconds:.2f}s, "
+              f"predicted {fitted:.2f}s after refit")
+
+    def _fit(self, kind):
+        """
+        Ridge least squares for the multipliers, called with the lock held.
+        Each job is normalised by its raw cost so long and short renders
+        weigh the same (relative error), and every multiplier is pulled
+        towards 1 so components not seen recently keep their static cost.
+        """
+        names = list(self.multipliers[kind])
+        n = len(names)
+        ata = [[FIT_PRIOR_WEIGHT if i == j else 0.0 for j in range(n)] for i in range(n)]
+        atb = [FIT_PRIOR_WEIGHT] * n
+
+        for components, actual in self.history[kind]:
+            raw = sum(components.values())
+            row = [components.get(name, 0) / raw for name in names]
+            target = actual / raw
+            for i in range(n):
+                if not row[i]:
+                    continue
+                atb[i] += row[i] * target
+                for j in range(n):
+                    ata[i][j] += row[i] * row[j]
+
+        try:
+            solution = solve_linear(ata, atb)
+        except ValueError:
+            return
+        low, high = MULTIPLIER_RANGE
+        for name, value in zip(names, solution):
+            self.multipliers[kind][name] = min(high, max(low, value))
+
+    def load(self, history_path):
+        """
+        Restore the fit window saved by earlier runs from history_path and
+        refit, then keep saving to it after every record().
+        """
+        history_path = Path(history_path)
+        with self._lock:
+            self.history_path = history_path
+            if not history_path.exists():
+                return
+            try:
+                with open(history_path) as f:
+                    data = json.load(f)
+                for kind in self.history:
+                    names = self.multipliers[kind]
+                    self.history[kind].clear()
+                    for job in data.get("history", {}).get(kind, []):
+                        # Drop components no longer in the model
+                        components = {k: float(v) for k, v in job["components"].items() if k in names}
+                        actual = float(job["actual_seconds"])
+                        if sum(components.values()) > 0 and actual > 0:
+                            self.history[kind].append((components, actual))
+                    self.samples[kind] = int(data.get("samples", {}).get(kind, len(self.history[kind])))
+                    self._fit(kind)
+                print(f"Cost model: loaded {sum(len(h) for h in self.history.values())} jobs from {history_path}")
+            except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+                print(f"Cost model: ignoring unreadable history {history_path}: {e}")
+
+    def _save(self):
+        """Write the fit window to history_path, called with the lock held."""
+        if self.history_path is None:
+            return
+        data = {
+            "samples": dict(self.samples),
+            "history": {
+                kind: [{"components": c, "actual_seconds": a} for c, a in jobs]
+                for kind, jobs in self.history.items()
+            },
+        }
+        try:
+            tmp_path = self.history_path.with_name(self.history_path.name + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.history_path)
+        except OSError as e:
+            print(f"Cost model: could not save history: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "multipliers": {kind: dict(m) for kind, m in self.multipliers.items()},
+                "samples": dict(self.samples),
+            }
+
+
+# Shared model instance; main.py loads its saved history at startup
+cost_model = RenderCostModel()
+
+
+def estimate_render(video_path, overlay_assets, overlays, props=None):
+    """
+    Estimate a render the same way render_video would run it.
+    props: pre-probed source properties; probed from video_path if None
+    """
+    if props is None:
+        props = probe_video(video_path)
+    inputs = [Path(video_path)] + [Path(p) for p in overlay_assets]
+    return cost_model.estimate(props, overlay_mix(inputs, overlays))
@@ -1,4 +1,5 @@
-from fastapi import FastAPI, UploadFile, File, Form, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, JSONResponse
 import uvicorn
@@ -8,6 +9,7 @@ import json
 from pathlib import Path
 from typing import Optional
 import uuid
+import time
 import aiofiles
 
 # Import our ffmpeg setup utility - handle both package and direct run
@@ -40,6 +42,8 @@ def root():
         "version": "1.0.0",
         "endpoints": {
             "upload": "POST /upload",
+            "estimate": "POST /estimate",
+            "preview": "GET /preview/{job_id}/{sprite.jpg|sprite.json|waveform.json}",
             "status": "GET /status/{job_id}",
             "result": "GET /result/{job_id}"
         }
@@ -67,35 +71,65 @@ def update_job_progress(job_id: str, progress: float):
 
 # Import rendering logic - handle both package and direct run
 try:
-    from .rendering import render_video
+    from .rendering import render_video, IMAGE_EXTENSIONS
+    from .cost_model import cost_model, probe_video, estimate_render
+    from .scheduler import scheduler_from_env
+    from .previews import (queue_previews, get_preview_status, preview_dir,
+                           PreviewStatus, PREVIEW_FILES, PREVIEW_CACHE_CONTROL)
 except ImportError:
-    from rendering import render_video
+    from rendering import render_video, IMAGE_EXTENSIONS
+    from cost_model import cost_model, probe_video, estimate_render
+    from scheduler import scheduler_from_env
+    from previews import (queue_previews, get_preview_status, preview_dir,
+                          PreviewStatus, PREVIEW_FILES, PREVIEW_CACHE_CONTROL)
+
+# Completed-job timings survive restarts so predictions stay calibrated
+cost_model.load(RESULT_DIR / "cost_model_history.json")
+
+# Render queue ordered by predicted cost (see RENDER_SCHEDULER_POLICY)
+scheduler = scheduler_from_env()
 
 def process_video(job_id: str, video_path: Path, overlay_assets: list, metadata: list):
     """
     Background task to process video with ffmpeg.
     """
     try:
+        jobs[job_id]["started_at"] = time.monotonic()
         jobs[job_id]["status"] = JobStatus.PROCESSING
         jobs[job_id]["progress"] = 0
         output_path = RESULT_DIR / f"{job_id}.mp4"
         
         # Run actual rendering with progress callback
         render_video(job_id, video_path, overlay_assets, metadata, output_path, update_job_progress)
+        render_seconds = time.monotonic() - jobs[job_id]["started_at"]
         
+        jobs[job_id]["result_path"] = str(output_path)
+        jobs[job_id]["render_seconds"] = round(render_seconds, 2)
         jobs[job_id]["status"] = JobStatus.COMPLETED
         jobs[job_id]["progress"] = 100
-        jobs[job_id]["result_path"] = str(output_path)
         print(f"Job {job_id} completed.")
         
     except Exception as e:
         print(f"Job {job_id} failed: {e}")
         jobs[job_id]["status"] = JobStatus.FAILED
         jobs[job_id]["error"] = str(e)
+        return
+    
+    # Feed the measured time back into the cost model; a failure here
+    # must not affect the finished render
+    try:
+        cost_model.record(jobs[job_id]["estimate"], render_seconds)
+    except Exception as e:
+        print(f"Job {job_id}: could not record render time: {e}")
+
+def remove_upload_files(paths: list):
+    """Delete files saved for an upload that was rejected."""
+    for path in paths:
+        Path(path).unlink(missing_ok=True)
 
 @app.post("/upload")
 async def upload_video(
-    background_tasks: BackgroundTasks,
+    request: Request,
     video: UploadFile = File(...),
     assets: list[UploadFile] = File(default=[]),
     metadata: str = Form(...)  # JSON string of overlays
@@ -152,6 +186,13 @@ async def upload_video(
         try:
             overlays = json.loads(metadata)
             
+            if not isinstance(overlays, list) or not all(isinstance(ov, dict) for ov in overlays):
+                remove_upload_files([video_path] + asset_paths)
+                return JSONResponse(
+                    status_code=400,
+                    content={"error": "Metadata must be a list of overlay objects"}
+                )
+            
             # Map overlays to the actual saved filenames on disk
             # This ensures rendering.py can find the files in the input list
             for ov in overlays:
@@ -168,27 +209,55 @@ async def upload_video(
                     ov["content"] = saved_filename
 
         except json.JSONDecodeError as e:
+            remove_upload_files([video_path] + asset_paths)
             return JSONResponse(
                 status_code=400, 
                 content={"error": f"Invalid metadata JSON: {str(e)}"}
             )
             
+        # Predict render time from the probed source and overlay mix
+        try:
+            estimate = await run_in_threadpool(estimate_render, video_path, asset_paths, overlays)
+        except (ValueError, TypeError, AttributeError) as e:
+            # Valid JSON but not valid overlays, e.g. non-numeric start/x or missing content
+            remove_upload_files([video_path] + asset_paths)
+            return JSONResponse(status_code=400, content={"error": f"Invalid overlay metadata: {str(e)}"})
+        print(f"[{job_id}] Estimated render time: {estimate['estimated_seconds']}s")
+        
+        # Fair-share is keyed on the caller's address; a client-chosen id
+        # could be changed per upload to jump the queue
+        client_id = request.client.host if request.client else "anonymous"
+            
         # Create Job
         jobs[job_id] = {
             "id": job_id,
             "status": JobStatus.QUEUED,
             "original_video": str(video_path),
             "overlays": overlays,
-            "progress": 0
+            "progress": 0,
+            "client_id": client_id,
+            "estimate": estimate,
+            "assets": [str(p) for p in asset_paths]
         }
         
-        # Trigger Background Processing
-        background_tasks.add_task(process_video, job_id, video_path, asset_paths, overlays)
+        # Queue for rendering
+        scheduler.submit(job_id, client_id, estimate["estimated_seconds"],
+                         process_video, job_id, video_path, asset_paths, overlays)
+        
+        # Timeline previews for the main video and video assets, on their own pool
+        queue_previews(video_path, estimate["source"])
+        for a_path in asset_paths:
+            if not str(a_path).lower().endswith(IMAGE_EXTENSIONS):
+                queue_previews(a_path)
         
         print(f"[{job_id}] Job queued successfully!")
         print(f"{'='*50}\n")
         
-        return {"job_id": job_id, "status": "queued"}
+        return {
+            "job_id": job_id,
+            "status": "queued",
+            "estimated_seconds": estimate["estimated_seconds"]
+        }
         
     except Exception as e:
         import traceback
@@ -199,18 +268,108 @@ async def upload_video(
             content={"error": f"Upload failed: {str(e)}"}
         )
 
+@app.post("/estimate")
+async def estimate_job(
+    video: Optional[UploadFile] = File(None),
+    metadata: str = Form("[]"),  # JSON string of overlays, same as /upload
+    duration: Optional[float] = Form(None),
+    width: Optional[int] = Form(None),
+    height: Optional[int] = Form(None),
+    fps: Optional[float] = Form(None)
+):
+    """
+    Dry run: predict render time without queuing a job.
+    Either upload the video to have it probed, or pass duration/width/height
+    (and optionally fps) when the client already knows them.
+    """
+    try:
+        overlays = json.loads(metadata)
+    except json.JSONDecodeError as e:
+        return JSONResponse(status_code=400, content={"error": f"Invalid metadata JSON: {str(e)}"})
+    
+    if not isinstance(overlays, list) or not all(isinstance(ov, dict) for ov in overlays):
+        return JSONResponse(status_code=400, content={"error": "Metadata must be a list of overlay objects"})
+    
+    if video is not None:
+        # Probe a temporary copy, it's removed as soon as we have the properties
+        probe_path = UPLOAD_DIR / f"estimate_{uuid.uuid4()}"
+        try:
+            async with aiofiles.open(probe_path, "wb") as buffer:
+                while True:
+                    chunk = await video.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    await buffer.write(chunk)
+            props = await run_in_threadpool(probe_video, probe_path)
+        finally:
+            probe_path.unlink(missing_ok=True)
+    elif duration is not None and width is not None and height is not None:
+        if duration <= 0 or width <= 0 or height <= 0 or (fps is not None and fps <= 0):
+            return JSONResponse(
+                status_code=400,
+                content={"error": "duration, width, height and fps must be positive"}
+            )
+        props = {"duration": duration, "width": width, "height": height, "fps": fps or 30.0}
+    else:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Provide a video or duration, width and height"}
+        )
+    
+    # Assets aren't needed for a dry run, overlays reference them by name
+    asset_names = [
+        ov["content"] for ov in overlays
+        if ov.get("type") in ["image", "video"] and "content" in ov
+    ]
+    try:
+        estimate = await run_in_threadpool(estimate_render, "video", asset_names, overlays, props)
+    except (ValueError, TypeError, AttributeError) as e:
+        # Valid JSON but not valid overlays, e.g. non-numeric start/x or missing content
+        return JSONResponse(status_code=400, content={"error": f"Invalid overlay metadata: {str(e)}"})
+    
+    return {
+        "estimated_seconds": estimate["estimated_seconds"],
+        "source": estimate["source"],
+        "overlay_mix": estimate["overlay_mix"],
+        "calibration_samples": estimate["calibration_samples"],
+        "scheduler": scheduler.stats()
+    }
+
 @app.get("/status/{job_id}")
 def get_status(job_id: str):
     job = jobs.get(job_id)
     if not job:
         return JSONResponse(status_code=404, content={"error": "Job not found"})
     
-    return {
+    estimated = job["estimate"]["estimated_seconds"]
+    response = {
         "job_id": job_id, 
         "status": job["status"], 
         "progress": job.get("progress", 0),
-        "error": job.get("error")
+        "error": job.get("error"),
+        "estimated_seconds": estimated,
+        "eta_seconds": None
     }
+    
+    if job["status"] == JobStatus.QUEUED:
+        info = scheduler.queue_info(job_id)
+        if info:
+            response["queue_position"] = info["queue_position"]
+            response["eta_seconds"] = round(info["wait_seconds"] + estimated, 2)
+    elif job["status"] == JobStatus.PROCESSING:
+        elapsed = time.monotonic() - job["started_at"]
+        progress = job.get("progress", 0)
+        if progress > 0:
+            # Extrapolate from the actual speed once ffmpeg reports progress
+            remaining = elapsed / progress * (100 - progress)
+        else:
+            remaining = max(0, estimated - elapsed)
+        response["eta_seconds"] = round(remaining, 2)
+    elif job["status"] == JobStatus.COMPLETED:
+        response["eta_seconds"] = 0
+        response["render_seconds"] = job.get("render_seconds")
+    
+    return response
 
 @app.get("/result/{job_id}")
 def get_result(job_id: str):
@@ -223,5 +382,46 @@ def get_result(job_id: str):
         
     return FileResponse(job["result_path"], media_type="video/mp4", filename="edited_video.mp4")
 
+def serve_preview(media_path: Path, filename: str):
+    """Serve a cached preview file, or report that it isn't ready yet."""
+    if filename not in PREVIEW_FILES:
+        return JSONResponse(status_code=404, content={"error": "Unknown preview file"})
+    
+    status = get_preview_status(media_path)
+    if status != PreviewStatus.READY:
+        # Don't let clients cache the not-ready answer
+        return JSONResponse(
+            status_code=202 if status == PreviewStatus.PENDING else 500,
+            content={"status": status},
+            headers={"Cache-Control": "no-store"}
+        )
+    
+    return FileResponse(
+        preview_dir(media_path) / filename,
+        media_type=PREVIEW_FILES[filename],
+        headers={"Cache-Control": PREVIEW_CACHE_CONTROL}
+    )
+
+@app.get("/preview/{job_id}/{filename}")
+def get_preview(job_id: str, filename: str):
+    job = jobs.get(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    
+    return serve_preview(Path(job["original_video"]), filename)
+
+@app.get("/preview/{job_id}/assets/{asset_name}/{filename}")
+def get_asset_preview(job_id: str, asset_name: str, filename: str):
+    job = jobs.get(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    
+    # Only video assets that belong to this job have previews
+    asset_path = UPLOAD_DIR / f"{job_id}_asset_{asset_name}"
+    if str(asset_path) not in job["assets"] or asset_name.lower().endswith(IMAGE_EXTENSIONS):
+        return JSONResponse(status_code=404, content={"error": "Asset not found"})
+    
+    return serve_preview(asset_path, filename)
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,303 @@
+import os
+import re
+import sys
+import json
+import math
+import array
+import shutil
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Handle both package and direct run imports
+try:
+    from .ffmpeg_utils import FFMPEG_EXE, FFPROBE_EXE
+    from .cost_model import probe_video
+except ImportError:
+    from ffmpeg_utils import FFMPEG_EXE, FFPROBE_EXE
+    from cost_model import probe_video
+
+# Sprite sheet: SPRITE_FRAMES thumbnails tiled SPRITE_COLUMNS wide
+SPRITE_FRAMES = 60
+SPRITE_COLUMNS = 10
+SPRITE_TILE_WIDTH = 160
+
+# Sources above this many megapixel-frames (about 10 minutes of 1080p30) only
+# decode keyframes for the sprite; shorter ones decode every frame so the
+# thumbnails land on their exact timestamps
+KEYFRAME_ONLY_MIN_MPIX_FRAMES = 40000
+
+# Picks the frame time out of ffmpeg's showinfo log lines
+SHOWINFO_PTS_RE = re.compile(r"Parsed_showinfo.*\bpts_time:\s*([-\d.]+)")
+
+# Waveform: audio is decoded mono at this rate and reduced to peaks
+WAVEFORM_SAMPLE_RATE = 8000
+WAVEFORM_POINTS_PER_SECOND = 10
+WAVEFORM_MAX_POINTS = 1000
+
+# ffmpeg is killed if a preview pass runs longer than base + per source second
+PREVIEW_TIMEOUT_BASE = 60
+PREVIEW_TIMEOUT_PER_SECOND = 0.5
+
+# Preview passes run on their own small pool, separate from RENDER_WORKERS
+try:
+    PREVIEW_WORKERS = max(1, int(os.environ.get("PREVIEW_WORKERS", "1")))
+except ValueError:
+    PREVIEW_WORKERS = 1
+
+# Previews never change for a given upload, so clients can cache them forever
+PREVIEW_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Files served for each media, the sprite index is written last and marks completion
+PREVIEW_FILES = {
+    "sprite.jpg": "image/jpeg",
+    "sprite.json": "application/json",
+    "waveform.json": "application/json",
+}
+
+# In-memory generation status keyed by preview directory (like the job store).
+# A complete sprite.json on disk always counts as ready; anything else without
+# an entry here is a leftover from an interrupted pass and counts as failed
+preview_status = {}
+
+preview_executor = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS, thread_name_prefix="preview-worker")
+
+
+class PreviewStatus:
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
+
+
+def preview_dir(media_path):
+    """Previews are cached next to the media, e.g. uploads/<name>.preview/"""
+    media_path = Path(media_path)
+    return media_path.with_name(media_path.name + ".preview")
+
+
+def get_preview_status(media_path):
+    out_dir = preview_dir(media_path)
+    if (out_dir / "sprite.json").exists():
+        return PreviewStatus.READY
+    return preview_status.get(str(out_dir), PreviewStatus.FAILED)
+
+
+def queue_previews(media_path, props=None):
+    """Mark media as pending and generate its previews on the preview pool."""
+    preview_status[str(preview_dir(media_path))] = PreviewStatus.PENDING
+    preview_executor.submit(generate_previews, media_path, props)
+
+
+def has_audio(media_path):
+    """Check whether the media has an audio stream using ffprobe."""
+    cmd = [
+        str(FFPROBE_EXE),
+        "-v", "error",
+        "-select_streams", "a",
+        "-show_entries", "stream=index",
+        "-of", "csv=p=0",
+        str(media_path)
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    return result.returncode == 0 and bool(result.stdout.strip())
+
+
+def read_waveform_peaks(stream, duration):
+    """
+    Reduce raw mono s16le samples from stream to peak values in 0..1,
+    WAVEFORM_POINTS_PER_SECOND of them (capped at WAVEFORM_MAX_POINTS).
+    """
+    total_samples = duration * WAVEFORM_SAMPLE_RATE
+    samples_per_point = max(
+        WAVEFORM_SAMPLE_RATE // WAVEFORM_POINTS_PER_SECOND,
+        math.ceil(total_samples / WAVEFORM_MAX_POINTS)
+    )
+
+    peaks = []
+    pending = array.array("h")
+    leftover = b""
+    while True:
+        chunk = stream.read(64 * 1024)
+        if not chunk:
+            break
+        chunk = leftover + chunk
+        # Keep an odd trailing byte for the next read
+        usable = len(chunk) - (len(chunk) % 2)
+        leftover = chunk[usable:]
+
+        samples = array.array("h")
+        samples.frombytes(chunk[:usable])
+        # s16le is little endian, array uses native order
+        if sys.byteorder != "little":
+            samples.byteswap()
+        pending.extend(samples)
+
+        while len(pending) >= samples_per_point:
+            bucket = pending[:samples_per_point]
+            peaks.append(max(max(bucket), -min(bucket)))
+            del pending[:samples_per_point]
+
+    if pending:
+        peaks.append(max(max(pending), -min(pending)))
+
+    return {
+        "sample_rate": WAVEFORM_SAMPLE_RATE,
+        "samples_per_point": samples_per_point,
+        "seconds_per_point": samples_per_point / WAVEFORM_SAMPLE_RATE,
+        "peaks": [round(min(peak, 32767) / 32767, 2) for peak in peaks],
+    }
+
+
+def generate_previews(media_path, props=None):
+    """
+    Generate the timeline sprite sheet, its JSON index and the audio waveform
+    for media_path in a single ffmpeg pass. Cached results are reused.
+    props: pre-probed source properties; probed from media_path if None
+    """
+    media_path = Path(media_path)
+    out_dir = preview_dir(media_path)
+    key = str(out_dir)
+    if get_preview_status(media_path) == PreviewStatus.READY:
+        return out_dir
+
+    preview_status[key] = PreviewStatus.PENDING
+    try:
+        out_dir.mkdir(exist_ok=True)
+        if props is None:
+            props = probe_video(media_path)
+        duration = props["duration"]
+        audio = has_audio(media_path)
+
+        # Tile size keeps the displayed aspect ratio (probe_video accounts for
+        # rotation, matching ffmpeg's auto-rotate); even height for yuv420p
+        tile_width = SPRITE_TILE_WIDTH
+        tile_height = max(2, round(tile_width * props["height"] / props["width"] / 2) * 2)
+        rows = math.ceil(SPRITE_FRAMES / SPRITE_COLUMNS)
+        interval = duration / SPRITE_FRAMES
+        mpix_frames = duration * props["fps"] * props["width"] * props["height"] / 1e6
+        keyframes_only = mpix_frames >= KEYFRAME_ONLY_MIN_MPIX_FRAMES
+
+        sprite_path = out_dir / "sprite.jpg"
+        cmd = [str(FFMPEG_EXE), "-y", "-hide_banner"]
+        # Run at lower CPU priority so previews yield to renders (POSIX only)
+        nice_exe = shutil.which("nice") if os.name == "posix" else None
+        if nice_exe:
+            cmd = [nice_exe, "-n", "10"] + cmd
+        if keyframes_only:
+            # Long/large source: decode keyframes only and keep those at least
+            # one interval apart. showinfo logs (at info level) which frames
+            # were kept, so the index lists the times actually in the sprite
+            select = f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{interval:.6f})'"
+            filter_str = (
+                f"[0:v]{select},showinfo,scale={tile_width}:{tile_height},"
+                f"tile={SPRITE_COLUMNS}x{rows}[sprite]"
+            )
+            cmd.extend(["-v", "info", "-skip_frame:v", "nokey"])
+        else:
+            filter_str = (
+                f"[0:v]fps={1 / interval:.6f},scale={tile_width}:{tile_height},"
+                f"tile={SPRITE_COLUMNS}x{rows}[sprite]"
+            )
+            cmd.extend(["-v", "error"])
+        cmd.extend([
+            "-i", str(media_path),
+            "-filter_complex", filter_str,
+            "-map", "[sprite]", "-frames:v", "1", "-q:v", "5", str(sprite_path),
+        ])
+        if audio:
+            # Second output of the same pass: raw mono samples on stdout
+            cmd.extend([
+                "-map", "0:a:0", "-ac", "1", "-ar", str(WAVEFORM_SAMPLE_RATE),
+                "-f", "s16le", "pipe:1"
+            ])
+
+        print(f"Generating previews: {' '.join(cmd)}")
+        timeout = PREVIEW_TIMEOUT_BASE + duration * PREVIEW_TIMEOUT_PER_SECOND
+        # stderr goes to a temp file: a pipe we only read at the end could fill
+        # up and block ffmpeg while we're blocked reading stdout
+        with tempfile.TemporaryFile() as stderr_file:
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE if audio else subprocess.DEVNULL,
+                stderr=stderr_file
+            )
+            # Killing ffmpeg also closes stdout, which ends the waveform read
+            timed_out = threading.Event()
+
+            def kill_on_timeout():
+                timed_out.set()
+                process.kill()
+
+            watchdog = threading.Timer(timeout, kill_on_timeout)
+            watchdog.start()
+            try:
+                if audio:
+                    waveform = read_waveform_peaks(process.stdout, duration)
+                else:
+                    waveform = {
+                        "sample_rate": WAVEFORM_SAMPLE_RATE,
+                        "samples_per_point": 0,
+                        "seconds_per_point": 0,
+                        "peaks": [],
+                    }
+                process.wait()
+            finally:
+                watchdog.cancel()
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+
+            stderr_file.seek(0)
+            errors = stderr_file.read().decode(errors="replace")
+
+        if timed_out.is_set():
+            raise Exception(f"FFmpeg timed out after {timeout:.0f}s: {errors[-1000:]}")
+        if process.returncode != 0 or not sprite_path.exists():
+            raise Exception(f"FFmpeg failed (code {process.returncode}): {errors[-1000:]}")
+
+        if keyframes_only:
+            timestamps = [
+                round(float(match.group(1)), 3)
+                for match in SHOWINFO_PTS_RE.finditer(errors)
+            ][:SPRITE_FRAMES]
+            if not timestamps:
+                raise Exception("No keyframes found for the sprite")
+        else:
+            timestamps = [round(i * interval, 3) for i in range(SPRITE_FRAMES)]
+
+        waveform["duration"] = duration
+        waveform["has_audio"] = audio
+        write_json(out_dir / "waveform.json", waveform)
+
+        # Written last: its presence means the preview is complete
+        write_json(out_dir / "sprite.json", {
+            "sprite": "sprite.jpg",
+            "duration": duration,
+            "frames": len(timestamps),
+            "columns": SPRITE_COLUMNS,
+            "rows": rows,
+            "tile_width": tile_width,
+            "tile_height": tile_height,
+            "interval": interval,
+            "keyframes_only": keyframes_only,
+            "timestamps": timestamps,
+        })
+
+        preview_status[key] = PreviewStatus.READY
+        print(f"Previews ready: {out_dir}")
+        return out_dir
+
+    except Exception as e:
+        print(f"Preview generation failed for {media_path}: {e}")
+        preview_status[key] = PreviewStatus.FAILED
+        return None
+
+
+def write_json(path, data):
+    """Write JSON atomically so a half-written file is never served."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
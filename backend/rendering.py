@@ -10,6 +10,9 @@ try:
 except ImportError:
     from ffmpeg_utils import FFMPEG_EXE
 
+# Overlay assets with these extensions are still images (looped when rendering)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')
+
 def build_filter_complex(inputs, overlays):
     """
     Constructs the ffmpeg filter complex string.
@@ -176,7 +179,7 @@ def render_video(job_id, main_video, overlay_assets, overlays, output_path, prog
     # Add overlay assets, looping images
     for asset in overlay_assets:
         asset_str = str(asset)
-        if asset_str.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')):
+        if asset_str.lower().endswith(IMAGE_EXTENSIONS):
             # Loop images so they don't disappear after 1 frame
             input_args.extend(["-loop", "1", "-i", asset_str])
         else:
@@ -0,0 +1,155 @@
+import os
+import time
+import threading
+
+# Scheduling policies:
+#   fifo - render jobs in submission order
+#   sjf  - shortest predicted job first (with aging so long jobs still run)
+#   fair - fair-share across clients by predicted render seconds consumed
+POLICIES = ("fifo", "sjf", "fair")
+
+# Seconds of predicted cost forgiven per second a job has waited (sjf)
+SJF_AGING = 1.0
+
+
+class RenderScheduler:
+    """
+    Runs render jobs on a fixed pool of worker threads, ordering the queue
+    by the cost model's predicted render time.
+    """
+
+    def __init__(self, policy="sjf", workers=2):
+        if policy not in POLICIES:
+            print(f"Unknown scheduler policy '{policy}', falling back to fifo")
+            policy = "fifo"
+        self.policy = policy
+        self.workers = max(1, workers)
+        self._cond = threading.Condition()
+        self._pending = []
+        self._running = {}
+        self._served = {}  # client_id -> predicted seconds dispatched (fair)
+        self._threads = []
+        self._seq = 0
+
+    def submit(self, job_id, client_id, estimated_seconds, func, *args):
+        """Queue func(*args) to run as job_id."""
+        with self._cond:
+            if self.policy == "fair" and not self._is_backlogged(client_id):
+                # A client returning from idle starts level with the
+                # least-served active client instead of its old total
+                active = [self._served.get(c, 0) for c in self._backlogged_clients()]
+                floor = min(active) if active else 0
+                self._served[client_id] = max(self._served.get(client_id, 0), floor)
+
+            self._seq += 1
+            self._pending.append({
+                "job_id": job_id,
+                "client_id": client_id,
+                "estimated_seconds": estimated_seconds,
+                "submitted_at": time.monotonic(),
+                "seq": self._seq,
+                "func": func,
+                "args": args,
+            })
+            self._ensure_workers()
+            self._cond.notify()
+
+    def queue_info(self, job_id):
+        """
+        Queue position (0 = next to run) and predicted seconds until job_id
+        starts, or None if the job isn't waiting.
+        """
+        with self._cond:
+            order = self._ordered(time.monotonic())
+            ids = [entry["job_id"] for entry in order]
+            if job_id not in ids:
+                return None
+            position = ids.index(job_id)
+
+            # Work ahead of us is shared by all workers
+            now = time.monotonic()
+            running = sum(
+                max(0, entry["estimated_seconds"] - (now - entry["started_at"]))
+                for entry in self._running.values()
+            )
+            ahead = sum(entry["estimated_seconds"] for entry in order[:position])
+            wait = (running + ahead) / self.workers
+            return {"queue_position": position, "wait_seconds": round(wait, 2)}
+
+    def stats(self):
+        with self._cond:
+            return {
+                "policy": self.policy,
+                "workers": self.workers,
+                "queued": len(self._pending),
+                "running": len(self._running),
+            }
+
+    def _is_backlogged(self, client_id):
+        return client_id in self._backlogged_clients()
+
+    def _backlogged_clients(self):
+        clients = {entry["client_id"] for entry in self._pending}
+        clients.update(entry["client_id"] for entry in self._running.values())
+        return clients
+
+    def _ordered(self, now):
+        """Pending jobs in the order the current policy would dispatch them."""
+        if self.policy == "sjf":
+            return sorted(
+                self._pending,
+                key=lambda e: (e["estimated_seconds"] - SJF_AGING * (now - e["submitted_at"]), e["seq"])
+            )
+
+        if self.policy == "fair":
+            # Simulate dispatch: always serve the client with the least
+            # predicted seconds so far, FIFO within a client
+            served = dict(self._served)
+            remaining = sorted(self._pending, key=lambda e: e["seq"])
+            order = []
+            while remaining:
+                nxt = min(remaining, key=lambda e: (served.get(e["client_id"], 0), e["seq"]))
+                served[nxt["client_id"]] = served.get(nxt["client_id"], 0) + nxt["estimated_seconds"]
+                remaining.remove(nxt)
+                order.append(nxt)
+            return order
+
+        return sorted(self._pending, key=lambda e: e["seq"])
+
+    def _ensure_workers(self):
+        # Called with the lock held; threads are started on first use
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker, daemon=True,
+                                 name=f"render-worker-{len(self._threads)}")
+            self._threads.append(t)
+            t.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                entry = self._ordered(time.monotonic())[0]
+                self._pending.remove(entry)
+                client = entry["client_id"]
+                self._served[client] = self._served.get(client, 0) + entry["estimated_seconds"]
+                entry["started_at"] = time.monotonic()
+                self._running[entry["job_id"]] = entry
+
+            try:
+                entry["func"](*entry["args"])
+            except Exception as e:
+                print(f"Render worker error for job {entry['job_id']}: {e}")
+            finally:
+                with self._cond:
+                    self._running.pop(entry["job_id"], None)
+
+
+def scheduler_from_env():
+    """Build the scheduler from RENDER_SCHEDULER_POLICY / RENDER_WORKERS."""
+    policy = os.environ.get("RENDER_SCHEDULER_POLICY", "sjf").lower()
+    try:
+        workers = int(os.environ.get("RENDER_WORKERS", "2"))
+    except ValueError:
+        workers = 2
+    return RenderScheduler(policy, workers)